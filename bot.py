@@ -1,9 +1,21 @@
+import asyncio
+import csv
+import io
 import logging
-from typing import Optional, Dict, List
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, Dict, List, Tuple
 from datetime import datetime
+import config
 from config import BOT_TOKEN, GROUP_ID
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command, StateFilter
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
+from aiogram.dispatcher.flags import get_flag
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
@@ -14,6 +26,7 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     ReplyKeyboardRemove,
+    BufferedInputFile,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
@@ -26,6 +39,8 @@ BOT_TOKEN = BOT_TOKEN
 if not BOT_TOKEN:
     raise ValueError("Пожалуйста, установите переменную среды BOT_TOKEN")
 
+ADMIN_IDS = getattr(config, "ADMIN_IDS", [])
+
 bot = Bot(token=BOT_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
@@ -58,6 +73,31 @@ db_users: Dict[int, User] = {}
 db_requests: Dict[int, Request] = {}
 request_counter = 0
 
+# Профили, созданные импортом и ещё не привязанные к Telegram-аккаунту
+db_pending_users: Dict[str, User] = {}
+# Индексы для поиска дубликатов: нормализованный телефон/username -> пользователь
+users_by_phone: Dict[str, User] = {}
+users_by_username: Dict[str, User] = {}
+
+PHONE_RE = re.compile(r"\D")
+USERNAME_RE = re.compile(r"^[a-z][a-z0-9_]{4,31}$")
+ROSTER_ROLES = {
+    "leader": "leader",
+    "лидер": "leader",
+    "лидер россии": "leader",
+    "duty": "duty",
+    "дежурный": "duty",
+    "дежурный по москве": "duty",
+}
+ROSTER_STATUSES = {"полуфиналист", "финалист", "победитель"}
+ROSTER_MAX_ERRORS_SHOWN = 20
+ROSTER_MAX_FILE_SIZE = 10 * 1024 * 1024
+
+@dataclass
+class RosterError:
+    line: int
+    message: str
+
 class Form(StatesGroup):
     full_name = State()
     phone = State()
@@ -69,6 +109,271 @@ class Form(StatesGroup):
     dates = State()
     feedback = State()
     rating = State()
+    roster = State()
+    claim_phone = State()
+
+def normalize_phone(phone: str) -> Optional[str]:
+    digits = PHONE_RE.sub("", phone)
+    if len(digits) == 10:
+        digits = "7" + digits
+    elif len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    if len(digits) != 11 or digits[0] != "7":
+        return None
+    return "+" + digits
+
+def normalize_username(username: str) -> Optional[str]:
+    username = username.strip().lstrip("@").lower()
+    if not USERNAME_RE.match(username):
+        return None
+    return username
+
+def is_pending(user: Optional[User]) -> bool:
+    return user is not None and db_pending_users.get(user.telegram_username) is user
+
+def index_user(user: User) -> None:
+    # Записи импортированных профилей не перезаписываем, пока их не заберут владельцы
+    phone = normalize_phone(user.phone)
+    if phone and not is_pending(users_by_phone.get(phone)):
+        users_by_phone[phone] = user
+    username = normalize_username(user.telegram_username)
+    if username and not is_pending(users_by_username.get(username)):
+        users_by_username[username] = user
+
+def save_user(user: User) -> None:
+    db_users[user.id] = user
+    index_user(user)
+
+def parse_roster(content: str) -> Tuple[List[User], List[RosterError]]:
+    """Разбирает CSV со списком участников.
+
+    Обязательные колонки: role, full_name, phone, telegram_username;
+    для Лидеров также season и status. Разделитель — запятая или точка с запятой.
+    """
+    first_line = content.split("\n", 1)[0]
+    delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    reader = csv.DictReader(io.StringIO(content), delimiter=delimiter)
+    if reader.fieldnames is None:
+        return [], [RosterError(1, "Файл пуст")]
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = {"role", "full_name", "phone", "telegram_username"} - set(reader.fieldnames)
+    if missing:
+        return [], [RosterError(1, f"Нет колонок: {', '.join(sorted(missing))}")]
+
+    users: List[User] = []
+    errors: List[RosterError] = []
+    seen_phones: Dict[str, int] = {}
+    seen_usernames: Dict[str, int] = {}
+
+    for row in reader:
+        line = reader.line_num
+        role = ROSTER_ROLES.get((row.get("role") or "").strip().lower())
+        full_name = (row.get("full_name") or "").strip()
+        phone = normalize_phone(row.get("phone") or "")
+        username = normalize_username(row.get("telegram_username") or "")
+
+        if role is None:
+            errors.append(RosterError(line, "неизвестная роль"))
+            continue
+        if not full_name:
+            errors.append(RosterError(line, "не указано ФИО"))
+            continue
+        if phone is None:
+            errors.append(RosterError(line, "некорректный телефон"))
+            continue
+        if username is None:
+            errors.append(RosterError(line, "некорректный username"))
+            continue
+        # Ещё не заявленный профиль с тем же username заменяется новой строкой
+        replaced = db_pending_users.get(username)
+        if username in users_by_username and users_by_username[username] is not replaced:
+            errors.append(RosterError(line, f"username @{username} уже зарегистрирован"))
+            continue
+        if phone in users_by_phone and users_by_phone[phone] is not replaced:
+            errors.append(RosterError(line, f"телефон {phone} уже зарегистрирован"))
+            continue
+        if phone in seen_phones:
+            errors.append(RosterError(line, f"телефон {phone} повторяет строку {seen_phones[phone]}"))
+            continue
+        if username in seen_usernames:
+            errors.append(RosterError(line, f"username @{username} повторяет строку {seen_usernames[username]}"))
+            continue
+
+        season = None
+        status = None
+        if role == "leader":
+            season_text = (row.get("season") or "").strip()
+            if not season_text.isdigit() or int(season_text) not in range(1, 6):
+                errors.append(RosterError(line, "сезон должен быть числом от 1 до 5"))
+                continue
+            season = int(season_text)
+            status = (row.get("status") or "").strip().lower()
+            if status not in ROSTER_STATUSES:
+                errors.append(RosterError(line, "некорректный статус участия"))
+                continue
+
+        seen_phones[phone] = line
+        seen_usernames[username] = line
+        users.append(
+            User(
+                id=0,
+                full_name=full_name,
+                phone=phone,
+                telegram_username=username,
+                role=role,
+                season=season,
+                status=status,
+            )
+        )
+
+    return users, errors
+
+def commit_roster(users: List[User]) -> None:
+    # Проверки parse_roster остаются верными, только если между ним и этой функцией нет await
+    for user in users:
+        old = db_pending_users.pop(user.telegram_username, None)
+        if old is not None and users_by_phone.get(old.phone) is old:
+            del users_by_phone[old.phone]
+        db_pending_users[user.telegram_username] = user
+        users_by_phone[user.phone] = user
+        users_by_username[user.telegram_username] = user
+
+def find_pending_user(username: Optional[str]) -> Optional[User]:
+    if not username:
+        return None
+    return db_pending_users.get(username.lower())
+
+def find_pending_user_by_phone(phone: str) -> Optional[User]:
+    user = users_by_phone.get(normalize_phone(phone) or "")
+    return user if is_pending(user) else None
+
+def claim_pending_user(user_id: int, username: Optional[str], phone: str) -> Optional[User]:
+    # Username мог смениться владельцем, поэтому профиль ищем по подтверждённому телефону
+    user = find_pending_user_by_phone(phone)
+    if user is None:
+        return None
+    del db_pending_users[user.telegram_username]
+    username = normalize_username(username or "")
+    if username and username != user.telegram_username:
+        if users_by_username.get(user.telegram_username) is user:
+            del users_by_username[user.telegram_username]
+        user.telegram_username = username
+        users_by_username[username] = user
+    user.id = user_id
+    db_users[user_id] = user
+    return user
+
+SLOW_HANDLER_THRESHOLD = 1.0  # секунды
+PROFILE_MAX_SECONDS = 300
+PROFILE_INTERVAL = 0.005
+
+# Вызовы Bot API, сделанные текущим хендлером: (метод, длительность)
+current_api_calls: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar(
+    "current_api_calls", default=None
+)
+
+class StackSampler:
+    """Статистический профайлер: периодически снимает стек потока event loop.
+
+    Результат — collapsed stacks (формат flamegraph.pl / speedscope).
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+
+    def run(self, duration: float) -> None:
+        # Во время сэмплирования только собираем code objects, строки строим в collapsed()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            self.samples[tuple(stack)] += 1
+            time.sleep(self.interval)
+
+    async def sample(self, duration: float) -> None:
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def target() -> None:
+            try:
+                self.run(duration)
+            finally:
+                loop.call_soon_threadsafe(done.set_result, None)
+
+        threading.Thread(target=target, name="stack-sampler", daemon=True).start()
+        await done
+
+    def collapsed(self) -> str:
+        names: Dict[Any, str] = {}
+        lines = []
+        for stack, count in self.samples.most_common():
+            for code in stack:
+                if code not in names:
+                    names[code] = (
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+            lines.append(f"{';'.join(names[code] for code in reversed(stack))} {count}\n")
+        return "".join(lines)
+
+profile_lock = asyncio.Lock()
+
+class SlowHandlerMiddleware(BaseMiddleware):
+    def __init__(self, update_type: str):
+        self.update_type = update_type
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        if get_flag(data, "skip_slow_log"):
+            return await handler(event, data)
+
+        api_calls: List[Tuple[str, float]] = []
+        token = current_api_calls.set(api_calls)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - start
+            current_api_calls.reset(token)
+            if duration > SLOW_HANDLER_THRESHOLD:
+                handler_object = data.get("handler")
+                handler_name = (
+                    getattr(handler_object.callback, "__qualname__", repr(handler_object.callback))
+                    if handler_object
+                    else "unknown"
+                )
+                logger.warning(
+                    "Slow handler %s (%s): %.3fs, Bot API calls: %s",
+                    handler_name,
+                    self.update_type,
+                    duration,
+                    ", ".join(f"{name} {elapsed:.3f}s" for name, elapsed in api_calls) or "none",
+                )
+
+async def track_api_call(make_request, bot: Bot, method):
+    api_calls = current_api_calls.get()
+    if api_calls is None:
+        return await make_request(bot, method)
+
+    start = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    finally:
+        api_calls.append((type(method).__name__, time.perf_counter() - start))
+
+dp.message.middleware(SlowHandlerMiddleware("message"))
+dp.callback_query.middleware(SlowHandlerMiddleware("callback_query"))
+bot.session.middleware(track_api_call)
 
 async def get_main_keyboard(user: User) -> ReplyKeyboardMarkup:
     if user.role == "leader":
@@ -112,7 +417,7 @@ async def send_request_to_duty_chat(request: Request, leader: User):
         f"📝 Запрос: {request.request_text}"
     )
     
-    logger.info(f"Request sent to duty chat:\n{text}")
+    logger.info("Request sent to duty chat:\n%s", text)
     
     await bot.send_message(
         chat_id=GROUP_ID,
@@ -131,19 +436,64 @@ async def command_start(message: Message, state: FSMContext) -> None:
             f"С возвращением, {user.full_name}!",
             reply_markup=keyboard,
         )
+    elif find_pending_user(message.from_user.username):
+        await ask_claim_phone(message, state)
     else:
-        await state.set_state(Form.role)
-        await message.answer(
-            "Добро пожаловать в бота 'Дежурный по Москве'!\n\n"
-            "Вы участник сообщества 'Лидеры России'?",
-            reply_markup=ReplyKeyboardMarkup(
-                keyboard=[
-                    [KeyboardButton(text="Я Лидер России")],
-                    [KeyboardButton(text="Я Дежурный по Москве")],
-                ],
-                resize_keyboard=True,
-            ),
-        )
+        await start_registration(message, state)
+
+async def ask_claim_phone(message: Message, state: FSMContext) -> None:
+    await state.set_state(Form.claim_phone)
+    await message.answer(
+        "Для вас уже создан профиль администратором.\n"
+        "Подтвердите номер телефона, чтобы войти:",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text="Отправить номер телефона", request_contact=True)],
+            ],
+            resize_keyboard=True,
+        ),
+    )
+
+async def start_registration(message: Message, state: FSMContext) -> None:
+    await state.set_state(Form.role)
+    await message.answer(
+        "Добро пожаловать в бота 'Дежурный по Москве'!\n\n"
+        "Вы участник сообщества 'Лидеры России'?",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text="Я Лидер России")],
+                [KeyboardButton(text="Я Дежурный по Москве")],
+            ],
+            resize_keyboard=True,
+        ),
+    )
+
+@dp.message(Form.claim_phone, F.contact)
+async def process_claim_phone(message: Message, state: FSMContext) -> None:
+    if message.contact.user_id != message.from_user.id:
+        await message.answer("Пожалуйста, отправьте свой номер кнопкой ниже.")
+        return
+
+    await state.clear()
+    user = claim_pending_user(
+        message.from_user.id,
+        message.from_user.username,
+        message.contact.phone_number,
+    )
+    if user is None:
+        await message.answer("Номер телефона не совпадает с данными профиля, пройдите регистрацию.")
+        await start_registration(message, state)
+        return
+
+    keyboard = await get_main_keyboard(user)
+    await message.answer(
+        f"Добро пожаловать, {user.full_name}!",
+        reply_markup=keyboard,
+    )
+
+@dp.message(Form.claim_phone)
+async def process_claim_phone_invalid(message: Message) -> None:
+    await message.answer("Пожалуйста, нажмите кнопку «Отправить номер телефона».")
 
 @dp.message(Form.role)
 async def process_role(message: Message, state: FSMContext) -> None:
@@ -172,6 +522,10 @@ async def process_full_name(message: Message, state: FSMContext) -> None:
 
 @dp.message(Form.phone)
 async def process_phone(message: Message, state: FSMContext) -> None:
+    if find_pending_user_by_phone(message.text):
+        await ask_claim_phone(message, state)
+        return
+
     await state.update_data(phone=message.text)
     await state.set_state(Form.telegram_username)
     await message.answer("Введите ваш username в Telegram (без @):")
@@ -191,7 +545,7 @@ async def process_telegram_username(message: Message, state: FSMContext) -> None
             telegram_username=data["telegram_username"],
             role=data["role"],
         )
-        db_users[message.from_user.id] = user
+        save_user(user)
         
         keyboard = await get_main_keyboard(user)
         await message.answer(
@@ -236,7 +590,7 @@ async def process_status(message: Message, state: FSMContext) -> None:
         season=data["season"],
         status=data["status"],
     )
-    db_users[message.from_user.id] = user
+    save_user(user)
     
     keyboard = await get_main_keyboard(user)
     await message.answer(
@@ -681,14 +1035,98 @@ async def show_profile(message: Message) -> None:
     
     await message.answer(text)
 
+@dp.message(Command("import"))
+async def command_import(message: Message, state: FSMContext) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("Эта команда доступна только администраторам.")
+        return
+
+    await state.set_state(Form.roster)
+    await message.answer(
+        "Отправьте CSV-файл со списком участников.\n"
+        "Колонки: role, full_name, phone, telegram_username, season, status\n"
+        "(season и status обязательны только для Лидеров России)."
+    )
+
+@dp.message(Form.roster, F.document)
+async def process_roster(message: Message, state: FSMContext) -> None:
+    if message.document.file_size and message.document.file_size > ROSTER_MAX_FILE_SIZE:
+        await message.answer(
+            f"Файл слишком большой: максимум {ROSTER_MAX_FILE_SIZE // (1024 * 1024)} МБ."
+        )
+        return
+
+    buffer = await bot.download(message.document)
+    try:
+        content = buffer.read().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await message.answer("Не удалось прочитать файл: ожидается CSV в кодировке UTF-8.")
+        return
+
+    await state.clear()
+    users, errors = parse_roster(content)
+
+    if errors:
+        text = "\n".join(
+            f"Строка {error.line}: {error.message}"
+            for error in errors[:ROSTER_MAX_ERRORS_SHOWN]
+        )
+        if len(errors) > ROSTER_MAX_ERRORS_SHOWN:
+            text += f"\n... и ещё {len(errors) - ROSTER_MAX_ERRORS_SHOWN}"
+        await message.answer(
+            f"Импорт отменён, найдено ошибок: {len(errors)}\n\n{text}"
+        )
+        return
+
+    commit_roster(users)
+    logger.info("Roster imported: %d users", len(users))
+    await message.answer(
+        f"Импортировано участников: {len(users)}.\n"
+        "Они смогут войти в бота командой /start."
+    )
+
+@dp.message(Form.roster)
+async def process_roster_invalid(message: Message) -> None:
+    await message.answer("Пожалуйста, отправьте CSV-файл со списком участников.")
+
+@dp.message(Command("profile"), flags={"skip_slow_log": True})
+async def command_profile(message: Message, command: CommandObject) -> None:
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("Эта команда доступна только администраторам.")
+        return
+
+    args = (command.args or "").strip()
+    if not args.isdigit() or int(args) not in range(1, PROFILE_MAX_SECONDS + 1):
+        await message.answer(f"Использование: /profile <секунды от 1 до {PROFILE_MAX_SECONDS}>")
+        return
+
+    if profile_lock.locked():
+        await message.answer("Профилирование уже запущено.")
+        return
+
+    async with profile_lock:
+        seconds = int(args)
+        await message.answer(f"Профилирование запущено на {seconds} с...")
+        sampler = StackSampler(threading.get_ident())
+        await sampler.sample(seconds)
+
+    total = sum(sampler.samples.values())
+    logger.info("Profile finished: %d samples in %d s", total, seconds)
+    await message.answer_document(
+        BufferedInputFile(
+            sampler.collapsed().encode("utf-8"),
+            filename=f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded",
+        ),
+        caption=f"Сэмплов: {total}. Формат collapsed stacks (flamegraph.pl, speedscope).",
+    )
+
 @dp.errors()
 async def errors_handler(update: types.Update, exception: Exception):
-    logger.error(f"Апдейт {update} вызвал ошибку {exception}")
+    logger.error("Апдейт %s вызвал ошибку %s", update, exception)
     return True
 
 async def main() -> None:
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())